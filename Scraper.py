@@ -1,12 +1,21 @@
 import asyncio
 import aiohttp
-import json
+import orjson
+import os
 import ssl
+import struct
 import certifi
+import contextlib
 import sys
 import time
+import random
 import logging
 
+try:
+    import uvloop
+except ImportError:  # uvloop is optional and not available on Windows
+    uvloop = None
+
 # Configure logging to stderr with INFO level
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s', stream=sys.stderr)
 logger = logging.getLogger(__name__)
@@ -14,170 +23,381 @@ logger = logging.getLogger(__name__)
 league_id = 314
 max_concurrent_requests = 50
 total_pages = 214849
-failed_attempts = []
-output_file = 'player_data.json'
+output_shards = 16
+output_file_template = 'player_data.{}.jsonl'
+progress_file = 'progress.bin'
+
+url_template = ('https://fantasy.premierleague.com/api/leagues-classic/'
+                f'{league_id}/standings/?page_standings={{}}')
 
 ssl_context = ssl.create_default_context(cafile=certifi.where())
 progress_interval = 10000
+keepalive_timeout = 75
+dns_cache_ttl = 3600
+recovery_window = 500
+max_rate_limit_wait = 60
+write_queue_size = 200
+write_batch_bytes = 1 << 20
+write_buffer_size = 1 << 20
+checkpoint_interval = 1000
+
+def page_done(done, page):
+    return done[(page - 1) >> 3] & (1 << ((page - 1) & 7))
+
+def mark_done(done, page):
+    done[(page - 1) >> 3] |= 1 << ((page - 1) & 7)
+
+output_files = [output_file_template.format(i) for i in range(output_shards)]
+offsets_format = f'<{output_shards}Q'
+
+def load_progress():
+    # Returns the completed-page bitset and the per-shard output offsets it is
+    # valid for. The offsets are None when there is no usable checkpoint.
+    size = (total_pages + 7) // 8
+    header_size = struct.calcsize(offsets_format)
+    try:
+        with open(progress_file, 'rb') as fp:
+            raw = fp.read()
+    except FileNotFoundError:
+        return bytearray(size), None
+    if len(raw) != header_size + size:
+        logger.warning("Ignoring %s: it was written for a different page or shard count.", progress_file)
+        return bytearray(size), None
+    missing = [path for path in output_files if not os.path.exists(path)]
+    if missing:
+        logger.warning("Ignoring %s: %s is missing.", progress_file, missing[0])
+        return bytearray(size), None
+    offsets = struct.unpack(offsets_format, raw[:header_size])
+    # A shard shorter than its checkpoint has lost records; truncate() would pad it with NULs.
+    short = [path for path, offset in zip(output_files, offsets) if os.path.getsize(path) < offset]
+    if short:
+        logger.warning("Ignoring %s: %s is shorter than its checkpoint.", progress_file, short[0])
+        return bytearray(size), None
+    return bytearray(raw[header_size:]), offsets
+
+def save_progress(files, done):
+    # Make the output durable first so the checkpoint never covers unwritten pages.
+    for f in files:
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_file = progress_file + '.tmp'
+    with open(tmp_file, 'wb') as fp:
+        fp.write(struct.pack(offsets_format, *(f.tell() for f in files)))
+        fp.write(done)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_file, progress_file)
+
+async def writer(files, queue, done):
+    # Single consumer for the output shards; coalesce queued pages into one write
+    # per shard and checkpoint the completed pages every checkpoint_interval pages.
+    # Writes are deliberately synchronous: do not wrap the output in aiofiles or
+    # run_in_executor. Buffered appends land in the OS page cache and return
+    # almost immediately, whereas thread-pool dispatch adds 2-4x overhead per
+    # small write. Only this coroutine touches the files, so no locking is needed.
+    since_checkpoint = 0
+    finished = False
+    while not finished:
+        item = await queue.get()
+        if item is None:
+            break
+        batch = [item]
+        size = sum(map(len, item[1]))
+        while size < write_batch_bytes and not queue.empty():
+            item = queue.get_nowait()
+            if item is None:
+                finished = True
+                break
+            batch.append(item)
+            size += sum(map(len, item[1]))
+        for shard, f in enumerate(files):
+            f.write(b''.join(chunks[shard] for _, chunks in batch))
+        for page, _ in batch:
+            mark_done(done, page)
+        since_checkpoint += len(batch)
+        if since_checkpoint >= checkpoint_interval:
+            save_progress(files, done)
+            since_checkpoint = 0
+    save_progress(files, done)
+
+class ConcurrencyLimiter:
+    # Counter guarded by an asyncio.Condition so the limit can be changed while
+    # requests are in flight (Semaphore has no supported way to resize).
+    # AIMD: halve the limit on a 429, add one back after a clean window.
+    # Only one halving per burst: 429s from requests that started before the
+    # last decrease were sent at the old limit and are ignored.
+    def __init__(self, limit):
+        self.limit = limit
+        self.max_limit = limit
+        self.active = 0
+        self.clean_pages = 0
+        self.last_decrease = float('-inf')
+        self.cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.cond:
+            self.active -= 1
+            self.cond.notify(1)
+
+    async def throttled(self, started):
+        async with self.cond:
+            self.clean_pages = 0
+            if started > self.last_decrease and self.limit > 1:
+                self.last_decrease = time.monotonic()
+                self.limit = max(1, self.limit // 2)
+                logger.warning("Rate limited, concurrency lowered to %d.", self.limit)
+
+    async def succeeded(self):
+        async with self.cond:
+            self.clean_pages += 1
+            if self.clean_pages >= recovery_window and self.limit < self.max_limit:
+                self.clean_pages = 0
+                self.limit += 1
+                logger.info("No rate limiting for %d pages, concurrency raised to %d.",
+                            recovery_window, self.limit)
+                self.cond.notify_all()
 
-async def fetch_page(session, page, semaphore, f):
-    url = f'https://fantasy.premierleague.com/api/leagues-classic/{league_id}/standings/?page_standings={page}'
+def parse_players(raw, shards):
+    # Parse the raw response bytes and append one JSONL record per player to the
+    # caller's per-shard buffers (Player ID modulo output_shards), which are
+    # cleared first so a retry starts clean.
+    # Returns the number of players, or None when standings.results is missing.
+    for buf in shards:
+        buf.clear()
+    data = orjson.loads(raw)
+    if 'standings' not in data or 'results' not in data['standings']:
+        return None
+    results = data['standings']['results']
+    dumps = orjson.dumps
+    for player in results:
+        # Emit the JSONL record directly; orjson escapes each value, no dict needed.
+        buf = shards[player['entry'] % output_shards]
+        buf += b'{"Full Name":'
+        buf += dumps(player['player_name'])
+        buf += b',"Team Name":'
+        buf += dumps(player['entry_name'])
+        buf += b',"Player ID":'
+        buf += dumps(player['entry'])
+        buf += b'}\n'
+    return len(results)
+
+async def fetch_page(session, page, limiter, queue, shards):
+    # Returns the page number if it could not be fetched, otherwise None.
+    # shards are the calling worker's reusable per-shard output buffers.
+    url = url_template.format(page)
     max_attempts = 5
+    rate_limit_wait = 0
 
     for attempt in range(max_attempts):
-        async with semaphore:
-            msg = f"Fetching page {page} (Attempt {attempt+1}/{max_attempts})..."
-            print("[INFO]", msg, flush=True)
-            logger.info(msg)
+        if rate_limit_wait:
+            # Back off outside the limiter so a throttled request doesn't hold a slot.
+            await asyncio.sleep(rate_limit_wait)
+            rate_limit_wait = 0
+
+        async with limiter:
+            logger.info("Fetching page %d (Attempt %d/%d)...", page, attempt + 1, max_attempts)
 
-            start = time.time()
+            start = time.monotonic()
             try:
                 async with session.get(url, ssl=ssl_context) as response:
                     if response.status == 429:
-                        wait_time = 5 * (2 ** attempt)
-                        msg = f"Rate limit hit on page {page}. Waiting {wait_time}s before retrying..."
-                        print("[WARN]", msg, flush=True)
-                        logger.warning(msg)
-                        await asyncio.sleep(wait_time)
+                        # Full jitter so concurrent workers don't retry in lockstep.
+                        rate_limit_wait = random.uniform(0, min(max_rate_limit_wait, 5 * (2 ** attempt)))
+                        logger.warning("Rate limit hit on page %d. Waiting %.1fs before retrying...",
+                                       page, rate_limit_wait)
+                        await limiter.throttled(start)
                         continue
 
                     if not (200 <= response.status < 300):
-                        msg = f"Page {page}: HTTP {response.status}. Retrying..."
-                        print("[ERROR]", msg, flush=True)
-                        logger.error(msg)
+                        logger.error("Page %d: HTTP %d. Retrying...", page, response.status)
                         await asyncio.sleep(2 ** attempt)
                         continue
 
-                    data = await response.json()
-                    if 'standings' in data and 'results' in data['standings']:
-                        results = data['standings']['results']
-                        for player in results:
-                            player_obj = {
-                                'Full Name': player['player_name'],
-                                'Team Name': player['entry_name'],
-                                'Player ID': player['entry']
-                            }
-                            f.write(json.dumps(player_obj, ensure_ascii=False) + '\n')
-                            f.flush()
-
-                        duration = time.time() - start
-                        msg = f"Page {page} fetched successfully with {len(results)} players in {duration:.2f}s."
-                        print("[INFO]", msg, flush=True)
-                        logger.info(msg)
-                        return
+                    count = parse_players(await response.read(), shards)
+                    if count is not None:
+                        await queue.put((page, [bytes(buf) for buf in shards]))
+                        await limiter.succeeded()
+
+                        duration = time.monotonic() - start
+                        logger.info("Page %d fetched successfully with %d players in %.2fs.",
+                                    page, count, duration)
+                        return None
                     else:
-                        msg = f"Page {page}: Expected keys not found in the response."
-                        print("[ERROR]", msg, flush=True)
-                        logger.error(msg)
-                        failed_attempts.append(page)
-                        return
+                        logger.error("Page %d: Expected keys not found in the response.", page)
+                        return page
 
             except aiohttp.ClientResponseError as cre:
-                msg = (f"ClientResponseError on page {page}, status {cre.status}. "
-                       f"Attempt {attempt+1}/{max_attempts}")
-                print("[ERROR]", msg, flush=True)
-                logger.error(msg)
+                logger.error("ClientResponseError on page %d, status %d. Attempt %d/%d",
+                             page, cre.status, attempt + 1, max_attempts)
                 if 500 <= cre.status < 600:
                     wait_time = (2 ** attempt)
-                    wmsg = f"Server error on page {page}. Waiting {wait_time}s before retry..."
-                    print("[WARN]", wmsg, flush=True)
-                    logger.warning(wmsg)
+                    logger.warning("Server error on page %d. Waiting %ds before retry...", page, wait_time)
                     await asyncio.sleep(wait_time)
                 else:
                     await asyncio.sleep(2)
                     if attempt == max_attempts - 1:
-                        failed_attempts.append(page)
-                        return
+                        return page
 
             except (aiohttp.ClientConnectionError, aiohttp.ClientOSError) as e:
                 wait_time = (2 ** attempt)
-                msg = f"Connection error on page {page}: {e}. Waiting {wait_time}s before retry..."
-                print("[ERROR]", msg, flush=True)
-                logger.error(msg)
+                logger.error("Connection error on page %d: %s. Waiting %ds before retry...",
+                             page, e, wait_time)
                 await asyncio.sleep(wait_time)
 
             except asyncio.CancelledError:
-                msg = "Task was cancelled."
-                print("[ERROR]", msg, flush=True)
-                logger.error(msg)
+                logger.error("Task was cancelled.")
                 raise
 
             except Exception as e:
                 wait_time = (2 ** attempt)
-                msg = f"Unexpected error on page {page}: {e}. Waiting {wait_time}s before retry..."
-                print("[ERROR]", msg, flush=True)
-                logger.error(msg)
+                logger.error("Unexpected error on page %d: %s. Waiting %ds before retry...",
+                             page, e, wait_time)
                 await asyncio.sleep(wait_time)
 
-    msg = f"All attempts failed for page {page}."
-    print("[ERROR]", msg, flush=True)
-    logger.error(msg)
-    failed_attempts.append(page)
+    logger.error("All attempts failed for page %d.", page)
+    return page
+
+
+async def fetch_worker(session, page_queue, limiter, queue):
+    # Pull page numbers until the None sentinel, so only a fixed pool of tasks exists.
+    # Returns the pages this worker failed to fetch.
+    failed = []
+    # Allocated once and reused for every page this worker fetches.
+    shards = [bytearray() for _ in range(output_shards)]
+    while True:
+        page = await page_queue.get()
+        if page is None:
+            break
+        failed_page = await fetch_page(session, page, limiter, queue, shards)
+        if failed_page is not None:
+            failed.append(failed_page)
+    return failed
+
+
+async def schedule_pages(page_queue, done, worker_count):
+    # Queue every unfinished page, then one None sentinel per worker.
+    for page in range(1, total_pages + 1):
+        if not page_done(done, page):
+            await page_queue.put(page)
+
+        if page % progress_interval == 0:
+            logger.info("Scheduled %d/%d pages so far...", page, total_pages)
+
+    for _ in range(worker_count):
+        await page_queue.put(None)
+
+    logger.info("All pages scheduled, now awaiting completion...")
 
 
 async def main():
     msg = (f"Starting scraper.\n"
            f"League ID: {league_id}, Total Pages: {total_pages}, Concurrency: {max_concurrent_requests}\n"
-           f"Output file: {output_file}")
-    print("[INFO]", msg, flush=True)
+           f"Output files: {output_files[0]} .. {output_files[-1]}")
     logger.info(msg)
 
     start_time = time.time()
 
-    semaphore = asyncio.Semaphore(max_concurrent_requests)
-    connector = aiohttp.TCPConnector(limit_per_host=max_concurrent_requests, ssl=ssl_context)
+    limiter = ConcurrencyLimiter(max_concurrent_requests)
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrent_requests,
+        limit_per_host=max_concurrent_requests,
+        ttl_dns_cache=dns_cache_ttl,
+        keepalive_timeout=keepalive_timeout,
+        ssl=ssl_context,
+    )
+
+    done, offsets = load_progress()
+    if offsets is not None:
+        # Drop anything written after the last checkpoint; those pages are refetched.
+        for path, offset in zip(output_files, offsets):
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        remaining = sum(1 for page in range(1, total_pages + 1) if not page_done(done, page))
+        logger.info("Resuming from %s: %d pages remaining.", progress_file, remaining)
+    output_mode = 'wb' if offsets is None else 'ab'
 
     async with aiohttp.ClientSession(connector=connector) as session:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            tasks = []
-            for page in range(1, total_pages + 1):
-                task = asyncio.create_task(fetch_page(session, page, semaphore, f))
-                tasks.append(task)
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(open(path, output_mode, buffering=write_buffer_size))
+                     for path in output_files]
+            queue = asyncio.Queue(maxsize=write_queue_size)
+            writer_task = asyncio.create_task(writer(files, queue, done))
+            page_queue = asyncio.Queue(maxsize=max_concurrent_requests * 2)
+            workers = [
+                asyncio.create_task(fetch_worker(session, page_queue, limiter, queue))
+                for _ in range(max_concurrent_requests)
+            ]
+            producer = asyncio.create_task(schedule_pages(page_queue, done, len(workers)))
+            fetching = asyncio.gather(producer, *workers, return_exceptions=True)
+
+            # If every worker dies, nothing drains page_queue and the producer would
+            # block forever on put(); cancel it once the last worker has finished.
+            def stop_scheduling(_):
+                if not producer.done():
+                    logger.error("Every fetch worker has exited; stopped scheduling pages.")
+                    producer.cancel()
+
+            asyncio.gather(*workers, return_exceptions=True).add_done_callback(stop_scheduling)
 
-                if page % progress_interval == 0:
-                    pmsg = f"Scheduled {page}/{total_pages} pages so far..."
-                    print("[INFO]", pmsg, flush=True)
-                    logger.info(pmsg)
+            # The writer only finishes before fetching does if it failed (e.g. ENOSPC).
+            # Stop fetching instead of blocking on a full queue, and re-raise its
+            # error; progress.bin keeps the last checkpoint for the resume.
+            await asyncio.wait([fetching, writer_task], return_when=asyncio.FIRST_COMPLETED)
+            if writer_task.done():
+                fetching.cancel()
+                await asyncio.gather(fetching, return_exceptions=True)
+                writer_task.result()
 
-            print("[INFO] All fetch tasks scheduled, now awaiting completion...", flush=True)
-            logger.info("All fetch tasks scheduled, now awaiting completion...")
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            results = fetching.result()
+            await queue.put(None)
+            await writer_task
 
     elapsed = time.time() - start_time
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError):
+            logger.error("Scheduler or fetch worker crashed: %r", result)
+    # The bitset is the source of truth for both the count and failed_attempts.json;
+    # it also covers pages lost to a crashed worker.
+    failed_attempts = [page for page in range(1, total_pages + 1) if not page_done(done, page)]
+    reported = {page for failed in results[1:] if isinstance(failed, list) for page in failed}
+    unprocessed = len(failed_attempts) - len(reported)
+    if unprocessed > 0:
+        logger.error("%d pages were never processed because a worker crashed.", unprocessed)
     failed_count = len(failed_attempts)
     success_count = total_pages - failed_count
 
-    print("[INFO] Data fetching complete.", flush=True)
     logger.info("Data fetching complete.")
-    print(f"[INFO] Total time: {elapsed:.2f}s", flush=True)
     logger.info(f"Total time: {elapsed:.2f}s")
-    print(f"[INFO] Succeeded: {success_count}, Failed: {failed_count}", flush=True)
     logger.info(f"Succeeded: {success_count}, Failed: {failed_count}")
 
-    with open('failed_attempts.json', 'w', encoding='utf-8') as f_fail:
-        json.dump({'Failed Pages': failed_attempts}, f_fail, ensure_ascii=False)
+    with open('failed_attempts.json', 'wb') as f_fail:
+        f_fail.write(orjson.dumps({'Failed Pages': failed_attempts}))
 
     if failed_count > 0:
-        msg = "Some pages failed. See failed_attempts.json for details."
-        print("[WARN]", msg, flush=True)
+        msg = (f"Some pages failed. See failed_attempts.json for details; "
+               f"rerun to retry them from {progress_file}.")
         logger.warning(msg)
     else:
         msg = "No failed pages!"
-        print("[INFO]", msg, flush=True)
         logger.info(msg)
+        os.remove(progress_file)
 
-    print("[INFO] Scraper finished.", flush=True)
     logger.info("Scraper finished.")
 
 
 if __name__ == "__main__":
+    # uvloop.run needs uvloop >= 0.18; older releases fall back to the default loop.
+    run = getattr(uvloop, 'run', None) or asyncio.run
     try:
-        asyncio.run(main())
+        run(main())
     except KeyboardInterrupt:
-        print("[ERROR] Script interrupted by user.", flush=True)
         logger.error("Script interrupted by user.")
         sys.exit(1)
     except Exception as e:
-        print("[ERROR] Unhandled exception at top-level:", e, flush=True)
         logger.error(f"Unhandled exception at top-level: {e}")
         sys.exit(1)